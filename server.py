@@ -6,7 +6,7 @@ Admin controlled storage duration, performance optimized
 """
 
 import sqlite3
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
 # Fix SQLite datetime warning
 sqlite3.register_adapter(datetime, lambda dt: dt.isoformat())
@@ -14,13 +14,18 @@ sqlite3.register_converter("DATETIME", lambda dt: datetime.fromisoformat(dt.deco
 
 from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session, abort, Response
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import FileWrapper
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 from werkzeug.security import generate_password_hash, check_password_hash
-import os, uuid, hashlib, time, threading, secrets, mimetypes, qrcode, io, base64
-from functools import wraps
+import os, uuid, time, threading, secrets, mimetypes, qrcode, io, queue, mmap
+from functools import wraps, lru_cache
+from urllib.parse import unquote, quote
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import shutil
-import mmap
-import concurrent.futures
+import unicodedata
+from collections import OrderedDict, Counter, deque
 
 # ===== LOGGING SETUP =====
 logging.basicConfig(
@@ -49,139 +54,336 @@ os.makedirs(TEMP_FOLDER, exist_ok=True)
 BANNER_MAX_SIZE = 16 * 1024 * 1024  # 16MB for banners
 ALLOWED_BANNER_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+_FILE_TYPES = {
+    'image': ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg'],
+    'video': ['mp4', 'avi', 'mov', 'mkv', 'flv', 'webm', 'wmv'],
+    'audio': ['mp3', 'wav', 'flac', 'aac', 'ogg', 'wma'],
+    'document': ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt'],
+    'archive': ['zip', 'rar', '7z', 'tar', 'gz']
+}
+EXT_TO_TYPE = {ext: file_type for file_type, exts in _FILE_TYPES.items() for ext in exts}
+
+# Behind a proxy, hand downloads over so it streams them with sendfile() and the
+# Python worker is free as soon as the headers are sent.
+# USE_X_SENDFILE=nginx (or 1/true/yes) sends X-Accel-Redirect and requires:
+#   location /_protected/ {
+#       internal;
+#       alias /path/to/storage/files/;
+#       sendfile on; sendfile_max_chunk 2m; tcp_nopush on;
+#   }
+# USE_X_SENDFILE=apache sends X-Sendfile and requires mod_xsendfile with:
+#   XSendFile On
+#   XSendFilePath /path/to/storage/files
+_x_sendfile = os.environ.get('USE_X_SENDFILE', '').lower()
+if _x_sendfile in ('1', 'true', 'yes', 'nginx'):
+    USE_X_SENDFILE = 'nginx'
+elif _x_sendfile == 'apache':
+    USE_X_SENDFILE = 'apache'
+else:
+    USE_X_SENDFILE = None
+X_ACCEL_PREFIX = '/_protected/'
+
 # Unlimited timeout cho file lớn
 from werkzeug.serving import WSGIRequestHandler
 WSGIRequestHandler.timeout = 0  # Unlimited
 
 # ===== DATABASE SETUP =====
-def init_db():
-    conn = sqlite3.connect('file_storage.db')
-    cursor = conn.cursor()
-    
-    # Files table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS files (
-            id TEXT PRIMARY KEY,
-            original_name TEXT NOT NULL,
-            stored_name TEXT NOT NULL,
-            file_type TEXT,
-            file_size INTEGER DEFAULT 0,
-            mime_type TEXT,
-            share_code TEXT UNIQUE NOT NULL,
-            password TEXT,
-            download_limit INTEGER DEFAULT 100,
-            download_count INTEGER DEFAULT 0,
-            uploaded_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            expires_at DATETIME,
-            last_accessed DATETIME,
-            uploader_ip TEXT,
-            description TEXT,
-            is_public BOOLEAN DEFAULT 1
-        )
-    ''')
-    
-    # Visitors table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS visitors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT UNIQUE,
-            ip_address TEXT,
-            user_agent TEXT,
-            first_visit DATETIME,
-            last_activity DATETIME,
-            page_views INTEGER DEFAULT 1,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-    
-    # Banners table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS banners (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            image_path TEXT,
-            link_url TEXT,
-            position TEXT CHECK(position IN ('left', 'right')),
-            clicks INTEGER DEFAULT 0,
-            status BOOLEAN DEFAULT 1,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Settings table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT,
-            description TEXT
-        )
-    ''')
+DB_PATH = 'file_storage.db'
+DB_POOL_SIZE = 16
+
+class ConnectionPool:
+    """Reusable SQLite connections, opened once instead of per request"""
+    def __init__(self, path, size):
+        self.path = path
+        self.connections = queue.Queue(maxsize=size)
     
-    # Download stats table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS download_stats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_id TEXT,
-            file_name TEXT,
-            download_ip TEXT,
-            download_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            user_agent TEXT,
-            FOREIGN KEY (file_id) REFERENCES files (id)
-        )
-    ''')
+    def connect(self):
+        # Connections live for the process, so SQLite's prepared-statement cache keeps paying off
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=512)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-65536')
+        # Wait on the WAL writer lock instead of failing with "database is locked"
+        conn.execute('PRAGMA busy_timeout=5000')
+        # Read pages straight from the OS page cache instead of copying them in
+        conn.execute('PRAGMA mmap_size=268435456')
+        return conn
     
-    # Insert default settings
-    default_settings = [
-        ('admin_username', 'admin', 'Admin username'),
-        ('admin_password_hash', generate_password_hash('admin123'), 'Admin password hash'),
-        ('site_title', 'File Storage & Sharing', 'Site title'),
-        ('maintenance_mode', 'false', 'Maintenance mode'),
-        ('auto_cleanup_enabled', 'false', 'Auto cleanup enabled'),
-        ('cleanup_interval_minutes', '60', 'Cleanup interval in minutes'),
-        ('default_expire_days', '30', 'Default file expiration days'),
-        ('max_file_size_gb', '25', 'Maximum file size in GB'),
-        ('max_download_limit', '100', 'Default max downloads per file'),
-        
-        # Performance settings
-        ('chunk_size_mb', '32', 'Upload chunk size in MB'),
-        ('max_concurrent_chunks', '8', 'Maximum concurrent chunks'),
-        ('max_workers', '8', 'Maximum worker threads'),
-        ('enable_chunked_upload', 'true', 'Enable chunked upload for large files'),
-        ('enable_compression', 'true', 'Enable gzip compression'),
-        ('enable_caching', 'true', 'Enable file caching'),
-        ('buffer_size_kb', '2048', 'I/O buffer size in KB'),
-        ('connection_timeout', '300', 'Connection timeout in seconds')
-    ]
+    def get(self):
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            return self.connect()
     
-    for key, value, desc in default_settings:
-        cursor.execute('INSERT OR IGNORE INTO settings (key, value, description) VALUES (?, ?, ?)', 
-                      (key, value, desc))
+    def put(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.connections.put_nowait(conn)
+        except queue.Full:
+            conn.close()
     
-    conn.commit()
-    conn.close()
+    @contextmanager
+    def acquire(self):
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            self.put(conn)
+
+pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+
+# One SQL string for both upload paths; the statement cache is keyed on exact text
+INSERT_FILE_SQL = '''
+    INSERT INTO files (
+        id, original_name, stored_name, file_type, file_size, 
+        mime_type, share_code, password, download_limit, uploaded_at, expires_at, 
+        uploader_ip, description, is_public
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Banner click path: the lookup fills get_banner_link's cache, the update is batched
+SQL_BANNER_LOOKUP_URL = 'SELECT link_url FROM banners WHERE id = ?'
+SQL_BANNER_CLICK_UPDATE = 'UPDATE banners SET clicks = clicks + ? WHERE id = ?'
+
+# Columns holding Unix epoch seconds; APIs return them as ISO 8601 UTC strings
+EPOCH_COLUMNS = [
+    ('files', 'uploaded_at'), ('files', 'expires_at'), ('files', 'last_accessed'),
+    ('visitors', 'first_visit'), ('visitors', 'last_activity')
+]
+
+def init_db():
+    with pool.acquire() as conn:
+        cursor = conn.cursor()
+        # WAL is persistent in the database file; readers stop blocking on the writer
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
+        # Files table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                id TEXT PRIMARY KEY,
+                original_name TEXT NOT NULL,
+                stored_name TEXT NOT NULL,
+                file_type TEXT,
+                file_size INTEGER DEFAULT 0,
+                mime_type TEXT,
+                share_code TEXT UNIQUE NOT NULL,
+                password TEXT,
+                download_limit INTEGER DEFAULT 100,
+                download_count INTEGER DEFAULT 0,
+                uploaded_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                expires_at INTEGER,
+                last_accessed INTEGER,
+                uploader_ip TEXT,
+                description TEXT,
+                is_public BOOLEAN DEFAULT 1
+            )
+        ''')
+        
+        # Visitors table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS visitors (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT UNIQUE,
+                ip_address TEXT,
+                user_agent TEXT,
+                first_visit INTEGER,
+                last_activity INTEGER,
+                page_views INTEGER DEFAULT 1,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+        
+        # Banners table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS banners (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT,
+                image_path TEXT,
+                link_url TEXT,
+                position TEXT CHECK(position IN ('left', 'right')),
+                clicks INTEGER DEFAULT 0,
+                status BOOLEAN DEFAULT 1,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Settings table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                description TEXT
+            )
+        ''')
+        
+        # Download stats table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS download_stats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                file_id TEXT,
+                file_name TEXT,
+                download_ip TEXT,
+                download_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                user_agent TEXT,
+                FOREIGN KEY (file_id) REFERENCES files (id)
+            )
+        ''')
+        
+        # Chunked upload progress, shared by every worker process: one row per received
+        # chunk (so retries are not counted twice) plus a running count per upload. The
+        # upload row outlives completion so late retries are recognised until it goes stale
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                file_id TEXT NOT NULL,
+                chunk_number INTEGER NOT NULL,
+                PRIMARY KEY (file_id, chunk_number)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunk_uploads (
+                file_id TEXT PRIMARY KEY,
+                received INTEGER NOT NULL DEFAULT 0,
+                completed INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER NOT NULL
+            )
+        ''')
+        
+        # Clear-all jobs and the stored files each one still has to unlink; a row is
+        # removed once its file is gone, so an interrupted job can be resumed
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                processed INTEGER NOT NULL DEFAULT 0,
+                deleted INTEGER NOT NULL DEFAULT 0,
+                updated_at INTEGER NOT NULL,
+                finished_at INTEGER
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_job_files (
+                job_id TEXT NOT NULL,
+                stored_name TEXT NOT NULL,
+                PRIMARY KEY (job_id, stored_name)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Schema version 1 stores timestamps as Unix epoch seconds; convert older ISO text
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] < 1:
+            for table, column in EPOCH_COLUMNS:
+                cursor.execute(f"""
+                    UPDATE {table} SET {column} = CAST(strftime('%s', {column}) AS INTEGER)
+                    WHERE typeof({column}) = 'text'
+                """)
+            cursor.execute('PRAGMA user_version = 1')
+        
+        # Indexes for hot lookups (expiry cleanup, per-file stats, visitor activity)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_expires ON files(expires_at) WHERE expires_at IS NOT NULL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_download_stats_file ON download_stats(file_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_visitors_session ON visitors(session_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_visitors_activity ON visitors(last_activity)')
+        # Covering index: the cache totals are summed from it without reading file rows
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_size ON files(file_size)')
+        # Dashboard counters (share_code is already indexed through its UNIQUE constraint)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_visitors_active ON visitors(is_active, last_activity)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_banners_status ON banners(status)')
+        # Admin listings page through files newest first (visitors use idx_visitors_activity)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_uploaded ON files(uploaded_at DESC)')
+        
+        # Insert default settings
+        default_settings = [
+            ('admin_username', 'admin', 'Admin username'),
+            ('site_title', 'File Storage & Sharing', 'Site title'),
+            ('maintenance_mode', 'false', 'Maintenance mode'),
+            ('auto_cleanup_enabled', 'false', 'Auto cleanup enabled'),
+            ('cleanup_interval_minutes', '60', 'Cleanup interval in minutes'),
+            ('default_expire_days', '30', 'Default file expiration days'),
+            ('max_file_size_gb', '25', 'Maximum file size in GB'),
+            ('max_download_limit', '100', 'Default max downloads per file'),
+            
+            # Performance settings
+            ('chunk_size_mb', '32', 'Upload chunk size in MB'),
+            ('max_concurrent_chunks', '8', 'Maximum concurrent chunks'),
+            ('max_workers', '8', 'Maximum worker threads'),
+            ('enable_chunked_upload', 'true', 'Enable chunked upload for large files'),
+            ('enable_compression', 'true', 'Enable gzip compression'),
+            ('enable_caching', 'true', 'Enable file caching'),
+            ('buffer_size_kb', '128', 'I/O buffer size in KB'),
+            ('connection_timeout', '300', 'Connection timeout in seconds')
+        ]
+        
+        for key, value, desc in default_settings:
+            cursor.execute('INSERT OR IGNORE INTO settings (key, value, description) VALUES (?, ?, ?)', 
+                          (key, value, desc))
+        
+        # Password hashing is deliberately slow; only do it when the row is missing
+        cursor.execute('SELECT 1 FROM settings WHERE key = ?', ('admin_password_hash',))
+        if not cursor.fetchone():
+            cursor.execute('INSERT INTO settings (key, value, description) VALUES (?, ?, ?)', 
+                          ('admin_password_hash', generate_password_hash('admin123'), 'Admin password hash'))
+        
+        conn.commit()
+        
+        # Schema version 2 has planner statistics for the indexes above; gather them once,
+        # later starts only refresh what drifted, with a bounded per-index sample
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] < 2:
+            cursor.execute('ANALYZE')
+            cursor.execute('PRAGMA user_version = 2')
+            conn.commit()
+        else:
+            cursor.execute('PRAGMA analysis_limit = 400')
+            cursor.execute('PRAGMA optimize')
 
 # Initialize database
 init_db()
 
+# ===== SETTINGS CACHE =====
+SETTINGS_CACHE_TTL = 30  # seconds
+_settings_cache = {}
+_settings_lock = threading.Lock()
+
+def cached_settings(loader):
+    """Serve a settings loader from memory, re-reading SQLite at most every SETTINGS_CACHE_TTL"""
+    @wraps(loader)
+    def wrapper():
+        with _settings_lock:
+            entry = _settings_cache.get(loader.__name__)
+            if entry is None or time.time() - entry['ts'] >= SETTINGS_CACHE_TTL:
+                entry = {'data': loader(), 'ts': time.time()}
+                _settings_cache[loader.__name__] = entry
+            data = entry['data']
+        return data.copy() if isinstance(data, dict) else data
+    return wrapper
+
+def invalidate_settings_cache():
+    with _settings_lock:
+        _settings_cache.clear()
+
 # ===== PERFORMANCE FUNCTIONS =====
+@cached_settings
 def get_performance_settings():
     """Get performance-related settings"""
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT key, value FROM settings 
-            WHERE key IN (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            'chunk_size_mb', 'max_concurrent_chunks', 'max_workers',
-            'enable_chunked_upload', 'enable_compression', 'enable_caching',
-            'buffer_size_kb', 'connection_timeout'
-        ))
-        
-        settings = dict(cursor.fetchall())
-        conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT key, value FROM settings 
+                WHERE key IN (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                'chunk_size_mb', 'max_concurrent_chunks', 'max_workers',
+                'enable_chunked_upload', 'enable_compression', 'enable_caching',
+                'buffer_size_kb', 'connection_timeout'
+            ))
+            
+            settings = dict(cursor.fetchall())
         
         return {
             'chunk_size_mb': int(settings.get('chunk_size_mb', 32)),
@@ -190,7 +392,7 @@ def get_performance_settings():
             'enable_chunked_upload': settings.get('enable_chunked_upload', 'true') == 'true',
             'enable_compression': settings.get('enable_compression', 'true') == 'true',
             'enable_caching': settings.get('enable_caching', 'true') == 'true',
-            'buffer_size_kb': int(settings.get('buffer_size_kb', 2048)),
+            'buffer_size_kb': int(settings.get('buffer_size_kb', 128)),
             'connection_timeout': int(settings.get('connection_timeout', 300))
         }
     except Exception as e:
@@ -202,17 +404,30 @@ def get_performance_settings():
             'enable_chunked_upload': True,
             'enable_compression': True,
             'enable_caching': True,
-            'buffer_size_kb': 2048,
+            'buffer_size_kb': 128,
             'connection_timeout': 300
         }
 
+def get_io_buffer_size(perf_settings):
+    """Upload copy buffer, clamped to 64 KB - 1 MB"""
+    # request.stream is a socket: reads return whatever has arrived, so buffers
+    # past ~1 MB only delay writes (128 KB is what cat and pigz use)
+    return min(max(perf_settings['buffer_size_kb'] * 1024, 64 * 1024), 1024 * 1024)
+
+def get_download_block_size(perf_settings):
+    """Download read size, clamped to 1 MB - 4 MB and page-aligned"""
+    # Disk reads are fastest around 1-2 MB: smaller blocks pay per-syscall overhead,
+    # larger ones only spill out of the CPU caches
+    block_size = min(max(perf_settings['buffer_size_kb'] * 1024, 1024 * 1024), 4 * 1024 * 1024)
+    return block_size - block_size % mmap.PAGESIZE
+
+@cached_settings
 def get_max_content_length():
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', ('max_file_size_gb',))
-        result = cursor.fetchone()
-        conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT value FROM settings WHERE key = ?', ('max_file_size_gb',))
+            result = cursor.fetchone()
         
         if result:
             max_gb = int(result[0])
@@ -227,10 +442,21 @@ app.config['MAX_CONTENT_LENGTH'] = get_max_content_length()
 
 # ===== VISITOR TRACKING =====
 class VisitorTracker:
+    ACTIVE_WINDOW = 300  # seconds a visitor counts as active
+    FLUSH_INTERVAL = 0.5  # seconds between batched visitor writes
+    FLUSH_BATCH_SIZE = 500
+    MAX_PENDING = 65536  # visits buffered before the oldest are dropped
+    
     def __init__(self):
-        self.active_visitors = {}
+        # session_id -> last seen (monotonic), kept in last-seen order
+        self.active_visitors = OrderedDict()
+        self.active_lock = threading.Lock()
+        # Ring buffer: under overload the oldest visits are dropped, not request threads blocked
+        self.pending_visits = deque(maxlen=self.MAX_PENDING)
         self.cleanup_thread = threading.Thread(target=self.cleanup_inactive_visitors, daemon=True)
         self.cleanup_thread.start()
+        self.writer_thread = threading.Thread(target=self.flush_visits, daemon=True)
+        self.writer_thread.start()
     
     def track_visitor(self, request):
         session_id = session.get('session_id')
@@ -240,56 +466,64 @@ class VisitorTracker:
         
         ip_address = request.remote_addr
         user_agent = request.headers.get('User-Agent', '')
-        current_time = datetime.now(timezone.utc)
-        
-        self.active_visitors[session_id] = current_time
-        
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
         
-        cursor.execute('SELECT id, page_views FROM visitors WHERE session_id = ?', (session_id,))
-        visitor = cursor.fetchone()
-        
-        if visitor:
-            cursor.execute('''
-                UPDATE visitors 
-                SET last_activity = ?, page_views = page_views + 1, is_active = 1
-                WHERE session_id = ?
-            ''', (current_time, session_id))
-        else:
-            cursor.execute('''
-                INSERT INTO visitors (session_id, ip_address, user_agent, first_visit, last_activity)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (session_id, ip_address, user_agent, current_time, current_time))
+        now = time.monotonic()
+        with self.active_lock:
+            self.active_visitors[session_id] = now
+            self.active_visitors.move_to_end(session_id)
+            self.prune_active_visitors(now - self.ACTIVE_WINDOW)
         
-        conn.commit()
-        conn.close()
+        # Written by flush_visits in batches, off the request thread
+        self.pending_visits.append((session_id, ip_address, user_agent, int(time.time())))
         
         return session_id
     
+    def flush_visits(self):
+        while True:
+            try:
+                time.sleep(self.FLUSH_INTERVAL)
+                
+                while self.pending_visits:
+                    batch = []
+                    while self.pending_visits and len(batch) < self.FLUSH_BATCH_SIZE:
+                        session_id, ip_address, user_agent, ts = self.pending_visits.popleft()
+                        batch.append((session_id, ip_address, user_agent, ts, ts))
+                    
+                    with pool.acquire() as conn:
+                        conn.execute('BEGIN IMMEDIATE')
+                        conn.executemany('''
+                            INSERT INTO visitors (session_id, ip_address, user_agent, first_visit, last_activity)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT(session_id) DO UPDATE
+                            SET last_activity = excluded.last_activity, page_views = page_views + 1, is_active = 1
+                        ''', batch)
+                        conn.commit()
+                
+            except Exception as e:
+                logger.error(f"Visitor flush error: {e}")
+    
+    def prune_active_visitors(self, cutoff_time):
+        """Drop expired sessions; they are always at the front, so this stops at the first live one"""
+        while self.active_visitors:
+            session_id, last_activity = next(iter(self.active_visitors.items()))
+            if last_activity > cutoff_time:
+                break
+            self.active_visitors.popitem(last=False)
+    
     def get_active_count(self):
-        current_time = datetime.now(timezone.utc)
-        cutoff_time = current_time - timedelta(minutes=5)
-        
-        self.active_visitors = {
-            sid: last_activity for sid, last_activity in self.active_visitors.items()
-            if last_activity > cutoff_time
-        }
-        
-        return len(self.active_visitors)
+        with self.active_lock:
+            self.prune_active_visitors(time.monotonic() - self.ACTIVE_WINDOW)
+            return len(self.active_visitors)
     
     def cleanup_inactive_visitors(self):
         while True:
             try:
                 time.sleep(300)
-                current_time = datetime.now(timezone.utc)
-                cutoff_time = current_time - timedelta(minutes=10)
+                cutoff_time = int(time.time()) - 600
                 
-                conn = sqlite3.connect('file_storage.db')
-                cursor = conn.cursor()
-                cursor.execute('UPDATE visitors SET is_active = 0 WHERE last_activity < ?', (cutoff_time,))
-                conn.commit()
-                conn.close()
+                with pool.acquire() as conn:
+                    conn.execute('UPDATE visitors SET is_active = 0 WHERE last_activity < ?', (cutoff_time,))
+                    conn.commit()
                 
             except Exception as e:
                 logger.error(f"Visitor cleanup error: {e}")
@@ -297,6 +531,8 @@ class VisitorTracker:
 visitor_tracker = VisitorTracker()
 
 # ===== CACHE SCHEDULER =====
+STALE_UPLOAD_AGE = 24 * 60 * 60  # seconds without a new chunk before an upload is abandoned
+
 class CacheScheduler:
     def __init__(self):
         self.scheduler_thread = threading.Thread(target=self.run_scheduler, daemon=True)
@@ -307,62 +543,85 @@ class CacheScheduler:
             try:
                 time.sleep(60)
                 
-                conn = sqlite3.connect('file_storage.db')
-                cursor = conn.cursor()
+                self.cleanup_stale_uploads()
+                maintain_cache_jobs()
+                
+                with pool.acquire() as conn:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute('SELECT key, value FROM settings WHERE key IN (?, ?)', 
+                                  ('auto_cleanup_enabled', 'cleanup_interval_minutes'))
+                    settings = dict(cursor.fetchall())
                 
-                cursor.execute('SELECT value FROM settings WHERE key = ?', ('auto_cleanup_enabled',))
-                enabled = cursor.fetchone()
-                enabled = enabled and enabled[0] == 'true'
+                enabled = settings.get('auto_cleanup_enabled') == 'true'
+                interval = int(settings.get('cleanup_interval_minutes', 60))
                 
                 if not enabled:
-                    conn.close()
                     continue
                 
-                cursor.execute('SELECT value FROM settings WHERE key = ?', ('cleanup_interval_minutes',))
-                interval = cursor.fetchone()
-                interval = int(interval[0]) if interval else 60
-                
-                conn.close()
-                
                 if hasattr(self, 'last_cleanup'):
-                    time_since_last = (datetime.now(timezone.utc) - self.last_cleanup).total_seconds() / 60
+                    time_since_last = (time.monotonic() - self.last_cleanup) / 60
                     if time_since_last < interval:
                         continue
                 
                 logger.info("Running scheduled cache cleanup...")
                 deleted_count = self.cleanup_expired_files()
                 logger.info(f"Scheduled cleanup completed: {deleted_count} files deleted")
-                self.last_cleanup = datetime.now(timezone.utc)
+                self.last_cleanup = time.monotonic()
                 
             except Exception as e:
                 logger.error(f"Scheduler error: {e}")
     
-    def cleanup_expired_files(self):
+    def cleanup_stale_uploads(self):
+        """Forget chunked uploads that stopped receiving chunks and remove their temp dirs"""
         try:
-            current_time = datetime.now(timezone.utc)
-            deleted_count = 0
+            stale_before = int(time.time()) - STALE_UPLOAD_AGE
             
-            conn = sqlite3.connect('file_storage.db')
-            cursor = conn.cursor()
+            with pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('SELECT file_id FROM chunk_uploads WHERE updated_at < ?', (stale_before,))
+                stale_uploads = [row[0] for row in cursor.fetchall()]
+                
+                for file_id in stale_uploads:
+                    cursor.execute('DELETE FROM upload_chunks WHERE file_id = ?', (file_id,))
+                    cursor.execute('DELETE FROM chunk_uploads WHERE file_id = ?', (file_id,))
+                
+                conn.commit()
             
-            cursor.execute('SELECT id, stored_name FROM files WHERE expires_at < ?', (current_time.isoformat(),))
-            expired_files = cursor.fetchall()
+            for file_id in stale_uploads:
+                temp_cleanup_queue.put(os.path.join(TEMP_FOLDER, file_id))
             
-            for file_id, stored_name in expired_files:
-                try:
-                    file_path = os.path.join(STORAGE_FOLDER, stored_name)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                    
-                    cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
-                    cursor.execute('DELETE FROM download_stats WHERE file_id = ?', (file_id,))
-                    deleted_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error deleting file {file_id}: {e}")
+            return len(stale_uploads)
             
-            conn.commit()
-            conn.close()
+        except Exception as e:
+            logger.error(f"Stale upload cleanup error: {e}")
+            return 0
+    
+    def cleanup_expired_files(self):
+        try:
+            deleted_count = 0
+            
+            with pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('SELECT id, stored_name FROM files WHERE expires_at < ?', (int(time.time()),))
+                expired_files = cursor.fetchall()
+                
+                for file_id, stored_name in expired_files:
+                    try:
+                        file_path = os.path.join(STORAGE_FOLDER, stored_name)
+                        if os.path.exists(file_path):
+                            os.remove(file_path)
+                        
+                        cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
+                        cursor.execute('DELETE FROM download_stats WHERE file_id = ?', (file_id,))
+                        deleted_count += 1
+                        
+                    except Exception as e:
+                        logger.error(f"Error deleting file {file_id}: {e}")
+                
+                conn.commit()
             
             return deleted_count
             
@@ -372,6 +631,203 @@ class CacheScheduler:
 
 cache_scheduler = CacheScheduler()
 
+# ===== TEMP CLEANUP =====
+# Chunk directories are removed here so a merge can respond before thousands of unlinks finish
+temp_cleanup_queue = queue.Queue()
+
+def run_temp_cleanup():
+    while True:
+        temp_dir = temp_cleanup_queue.get()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+temp_cleanup_thread = threading.Thread(target=run_temp_cleanup, daemon=True)
+temp_cleanup_thread.start()
+
+# ===== DOWNLOAD STATS =====
+class DownloadStatsWriter:
+    """Batches download_stats rows so a download only waits on its counter update"""
+    FLUSH_INTERVAL = 0.5  # seconds between batched stats writes
+    FLUSH_BATCH_SIZE = 256
+    MAX_PENDING = 65536  # rows buffered before the oldest are dropped
+    
+    def __init__(self):
+        # Ring buffer: stats are analytics, losing the oldest under overload is acceptable
+        self.pending_rows = deque(maxlen=self.MAX_PENDING)
+        self.writer_thread = threading.Thread(target=self.flush_rows, daemon=True)
+        self.writer_thread.start()
+    
+    def record(self, file_id, file_name, download_ip, user_agent):
+        # Same text format as the column's CURRENT_TIMESTAMP default
+        download_time = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self.pending_rows.append((file_id, file_name, download_ip, download_time, user_agent))
+    
+    def flush_rows(self):
+        while True:
+            try:
+                time.sleep(self.FLUSH_INTERVAL)
+                
+                while self.pending_rows:
+                    batch = []
+                    while self.pending_rows and len(batch) < self.FLUSH_BATCH_SIZE:
+                        batch.append(self.pending_rows.popleft())
+                    
+                    with pool.acquire() as conn:
+                        conn.execute('BEGIN IMMEDIATE')
+                        conn.executemany('''
+                            INSERT INTO download_stats (file_id, file_name, download_ip, download_time, user_agent)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', batch)
+                        conn.commit()
+                
+            except Exception as e:
+                logger.error(f"Download stats flush error: {e}")
+
+download_stats_writer = DownloadStatsWriter()
+
+# ===== BANNER CLICKS =====
+class BannerClickCounter:
+    """Counts banner clicks in memory and adds them to SQLite in one batch"""
+    FLUSH_INTERVAL = 2  # seconds between click flushes
+    
+    def __init__(self):
+        self.pending_clicks = Counter()
+        self.clicks_lock = threading.Lock()
+        self.writer_thread = threading.Thread(target=self.flush_clicks, daemon=True)
+        self.writer_thread.start()
+    
+    def add(self, banner_id):
+        with self.clicks_lock:
+            self.pending_clicks[banner_id] += 1
+    
+    def flush_clicks(self):
+        while True:
+            try:
+                time.sleep(self.FLUSH_INTERVAL)
+                
+                with self.clicks_lock:
+                    clicks, self.pending_clicks = self.pending_clicks, Counter()
+                if not clicks:
+                    continue
+                
+                with pool.acquire() as conn:
+                    conn.executemany(SQL_BANNER_CLICK_UPDATE,
+                                     [(count, banner_id) for banner_id, count in clicks.items()])
+                    conn.commit()
+                
+            except Exception as e:
+                logger.error(f"Banner click flush error: {e}")
+
+banner_click_counter = BannerClickCounter()
+
+def get_banner_link(banner_id):
+    """link_url of a banner ('' if it has none), or None if the banner does not exist"""
+    # Keyed on the current SETTINGS_CACHE_TTL window so edits made in another worker
+    # show up here within the same bound as settings changes
+    return _lookup_banner_link(banner_id, int(time.time() // SETTINGS_CACHE_TTL))
+
+def invalidate_banner_links():
+    _lookup_banner_link.cache_clear()
+
+@lru_cache(maxsize=1024)
+def _lookup_banner_link(banner_id, ttl_window):
+    with pool.acquire() as conn:
+        result = conn.execute(SQL_BANNER_LOOKUP_URL, (banner_id,)).fetchone()
+    if not result:
+        return None
+    return result[0] or ''
+
+# ===== CACHE JOBS =====
+# clear_all empties the tables at once; unlinking the files is I/O-bound and runs here.
+# Job state lives in SQLite so any worker can report it and an interrupted job resumes
+cache_job_executor = ThreadPoolExecutor(max_workers=8)
+CACHE_JOB_BATCH = 256          # files unlinked between progress commits
+CACHE_JOB_STALE = 2 * 60       # seconds without progress before a running job is resumed
+CACHE_JOB_RETENTION = 10 * 60  # seconds a finished job stays pollable
+
+def unlink_stored_file(stored_name):
+    try:
+        os.unlink(os.path.join(STORAGE_FOLDER, stored_name))
+        return True
+    except FileNotFoundError:
+        return False
+
+def finish_clear_job(job_id, status):
+    now = int(time.time())
+    with pool.acquire() as conn:
+        conn.execute('UPDATE cache_jobs SET status = ?, updated_at = ?, finished_at = ? WHERE id = ?',
+                     (status, now, now, job_id))
+        conn.commit()
+
+def run_clear_job(job_id):
+    """Unlink the files a clear-all job still has pending, committing progress per batch"""
+    try:
+        with pool.acquire() as conn:
+            stored_names = [row[0] for row in conn.execute(
+                'SELECT stored_name FROM cache_job_files WHERE job_id = ?', (job_id,))]
+        
+        for start in range(0, len(stored_names), CACHE_JOB_BATCH):
+            batch = stored_names[start:start + CACHE_JOB_BATCH]
+            deleted = sum(cache_job_executor.map(unlink_stored_file, batch))
+            
+            with pool.acquire() as conn:
+                conn.executemany('DELETE FROM cache_job_files WHERE job_id = ? AND stored_name = ?',
+                                 [(job_id, stored_name) for stored_name in batch])
+                conn.execute('''
+                    UPDATE cache_jobs SET processed = processed + ?, deleted = deleted + ?, updated_at = ?
+                    WHERE id = ?
+                ''', (len(batch), deleted, int(time.time()), job_id))
+                conn.commit()
+        
+        finish_clear_job(job_id, 'done')
+    except Exception as e:
+        logger.error(f"Clear all job error: {e}")
+        finish_clear_job(job_id, 'failed')
+
+def start_clear_all():
+    """Delete every file record now and unlink the stored files in the background"""
+    job_id = uuid.uuid4().hex[:12]
+    
+    with pool.acquire() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        total = conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        conn.execute('INSERT INTO cache_jobs (id, status, total, updated_at) VALUES (?, ?, ?, ?)',
+                     (job_id, 'running', total, int(time.time())))
+        conn.execute('INSERT INTO cache_job_files (job_id, stored_name) SELECT ?, stored_name FROM files',
+                     (job_id,))
+        conn.execute('DELETE FROM files')
+        conn.execute('DELETE FROM download_stats')
+        conn.commit()
+    
+    threading.Thread(target=run_clear_job, args=(job_id,), daemon=True).start()
+    
+    return job_id, total
+
+def maintain_cache_jobs():
+    """Resume running jobs whose worker stopped making progress and drop old finished jobs"""
+    now = int(time.time())
+    resumed = []
+    
+    with pool.acquire() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        stale_jobs = [row[0] for row in conn.execute(
+            "SELECT id FROM cache_jobs WHERE status = 'running' AND updated_at < ?",
+            (now - CACHE_JOB_STALE,))]
+        for job_id in stale_jobs:
+            # Claiming under the write lock means only one worker resumes each job
+            conn.execute('UPDATE cache_jobs SET updated_at = ? WHERE id = ?', (now, job_id))
+            resumed.append(job_id)
+        
+        old_jobs = [row[0] for row in conn.execute(
+            'SELECT id FROM cache_jobs WHERE finished_at < ?', (now - CACHE_JOB_RETENTION,))]
+        for job_id in old_jobs:
+            conn.execute('DELETE FROM cache_job_files WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM cache_jobs WHERE id = ?', (job_id,))
+        conn.commit()
+    
+    for job_id in resumed:
+        logger.info(f"Resuming clear all job {job_id}")
+        threading.Thread(target=run_clear_job, args=(job_id,), daemon=True).start()
+
 # ===== ADMIN AUTHENTICATION =====
 def admin_required(f):
     @wraps(f)
@@ -382,16 +838,16 @@ def admin_required(f):
     return decorated_function
 
 # ===== UTILITY FUNCTIONS =====
+@cached_settings
 def get_admin_settings():
     """Get admin-controlled settings"""
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT key, value FROM settings WHERE key IN (?, ?, ?)', 
-                      ('default_expire_days', 'max_file_size_gb', 'max_download_limit'))
-        settings = dict(cursor.fetchall())
-        conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT key, value FROM settings WHERE key IN (?, ?, ?)', 
+                          ('default_expire_days', 'max_file_size_gb', 'max_download_limit'))
+            settings = dict(cursor.fetchall())
         
         return {
             'expire_days': int(settings.get('default_expire_days', 30)),
@@ -403,59 +859,37 @@ def get_admin_settings():
 
 def get_banners(position=None):
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        if position:
-            cursor.execute('SELECT * FROM banners WHERE position = ? AND status = 1 ORDER BY id DESC', (position,))
-        else:
-            cursor.execute('SELECT * FROM banners WHERE status = 1 ORDER BY id DESC')
-        
-        banners = cursor.fetchall()
-        conn.close()
-        
-        banner_list = []
-        for banner in banners:
-            banner_list.append({
-                'id': banner[0],
-                'title': banner[1],
-                'description': banner[2],
-                'image_path': banner[3],
-                'link_url': banner[4],
-                'position': banner[5],
-                'clicks': banner[6],
-                'status': banner[7],
-                'created_at': banner[8]
-            })
-        
-        return banner_list
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            if position:
+                cursor.execute('SELECT * FROM banners WHERE position = ? AND status = 1 ORDER BY id DESC', (position,))
+            else:
+                cursor.execute('SELECT * FROM banners WHERE status = 1 ORDER BY id DESC')
+            
+            return [dict(banner) for banner in cursor]
         
     except Exception as e:
         logger.error(f"Error getting banners: {e}")
         return []
 
+MAX_PAGE_SIZE = 200  # rows per admin listing page
+
+def get_pagination():
+    """page and limit from the query string, clamped to sane values"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+    return page, limit
+
 def generate_share_code():
-    return hashlib.md5(str(uuid.uuid4()).encode()).hexdigest()[:12]
+    # 9 random bytes -> 12 URL-safe characters; files.share_code is UNIQUE
+    return secrets.token_urlsafe(9)
 
 def get_file_type(filename):
     if not filename or '.' not in filename:
         return 'other'
     
-    ext = filename.rsplit('.', 1)[1].lower()
-    
-    file_types = {
-        'image': ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg'],
-        'video': ['mp4', 'avi', 'mov', 'mkv', 'flv', 'webm', 'wmv'],
-        'audio': ['mp3', 'wav', 'flac', 'aac', 'ogg', 'wma'],
-        'document': ['pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt'],
-        'archive': ['zip', 'rar', '7z', 'tar', 'gz']
-    }
-    
-    for file_type, extensions in file_types.items():
-        if ext in extensions:
-            return file_type
-    
-    return 'other'
+    return EXT_TO_TYPE.get(filename.rsplit('.', 1)[1].lower(), 'other')
 
 def format_file_size(size_bytes):
     if size_bytes == 0:
@@ -469,7 +903,9 @@ def format_file_size(size_bytes):
     
     return f"{size_bytes:.1f}{size_names[i]}"
 
+@lru_cache(maxsize=4096)
 def generate_qr_code(url):
+    """PNG bytes of the share URL's QR code; deterministic, so results are memoized"""
     try:
         qr = qrcode.QRCode(version=1, box_size=10, border=5)
         qr.add_data(url)
@@ -479,52 +915,191 @@ def generate_qr_code(url):
         
         img_buffer = io.BytesIO()
         img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
         
-        return base64.b64encode(img_buffer.getvalue()).decode()
+        return img_buffer.getvalue()
     except:
         return None
 
-def read_chunk_file(temp_dir, chunk_index):
-    """Read chunk file efficiently"""
-    chunk_path = os.path.join(temp_dir, f'chunk_{chunk_index:06d}')
-    with open(chunk_path, 'rb') as f:
-        return f.read()
+@lru_cache(maxsize=4096)
+def offload_headers(stored_name, original_name):
+    """Headers handing a download to the proxy; popular files reuse the same dict"""
+    # ASCII fallback for old clients, RFC 5987 UTF-8 name for everyone else
+    fallback = unicodedata.normalize('NFKD', original_name).encode('ascii', 'ignore').decode('ascii')
+    fallback = ''.join(c for c in fallback if c.isprintable() and c not in '"\\') or 'download'
+    headers = {
+        'Content-Disposition': f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(original_name, safe='')}",
+        'Cache-Control': 'no-cache'
+    }
+    if USE_X_SENDFILE == 'apache':
+        headers['X-Sendfile'] = os.path.abspath(os.path.join(STORAGE_FOLDER, stored_name))
+    else:
+        headers['X-Accel-Redirect'] = X_ACCEL_PREFIX + stored_name
+    return headers
+
+def proxy_revalidates(stat):
+    """Whether the proxy will answer this request's validators with a 304 for a file with this stat"""
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2). Only
+    # nginx's ETag format ("<mtime hex>-<size hex>") is known; any other proxy's tag
+    # cannot be matched here, so such a request is counted rather than let through
+    if request.if_none_match:
+        if USE_X_SENDFILE != 'nginx':
+            return False
+        return request.if_none_match.contains_weak(f'{int(stat.st_mtime):x}-{stat.st_size:x}')
+    if request.if_modified_since:
+        return int(stat.st_mtime) <= request.if_modified_since.timestamp()
+    return False
+
+WRITEBACK_WINDOW = 64 * 1024 * 1024  # bytes written between page-cache drops
+
+def write_stream(stream, f, buffer_size):
+    """Copy an upload stream into f without letting it flood the page cache"""
+    # O_DIRECT needs block-aligned reads, which a socket stream cannot give. Instead
+    # POSIX_FADV_DONTNEED starts writeback of each window; advising it again one
+    # window later drops the now-clean pages.
+    can_drop = hasattr(os, 'posix_fadvise')
+    total_size = 0
+    window_start = prev_window_start = 0
+    
+    while True:
+        data = stream.read(buffer_size)
+        if not data:
+            break
+        f.write(data)
+        total_size += len(data)
+        
+        if can_drop and total_size - window_start >= WRITEBACK_WINDOW:
+            f.flush()
+            os.posix_fadvise(f.fileno(), prev_window_start, total_size - prev_window_start,
+                             os.POSIX_FADV_DONTNEED)
+            prev_window_start, window_start = window_start, total_size
+    
+    return total_size
+
+DOWNLOAD_PREFETCH = 64 * 1024 * 1024  # bytes read ahead as soon as a download starts
+DROP_BEHIND_MIN_SIZE = 64 * 1024 * 1024  # downloads this large don't stay in the page cache
+
+def advise_download(fd, offset, file_size):
+    """Tell the kernel a download reads fd front to back from offset"""
+    # Readahead otherwise starts small and only grows once it detects the pattern
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, offset, min(file_size - offset, DOWNLOAD_PREFETCH), os.POSIX_FADV_WILLNEED)
+
+class DropBehindFileWrapper(FileWrapper):
+    """FileWrapper that evicts each block from the page cache once it has been sent"""
+    def __next__(self):
+        offset = self.file.tell()
+        data = super().__next__()
+        os.posix_fadvise(self.file.fileno(), offset, len(data), os.POSIX_FADV_DONTNEED)
+        return data
+
+def sequential_file_wrapper(block_size):
+    """wsgi.file_wrapper stand-in for servers without one"""
+    def wrap(f, _):
+        # Big files are rarely fetched again soon; don't let them push hot files out
+        if hasattr(os, 'posix_fadvise') and os.fstat(f.fileno()).st_size >= DROP_BEHIND_MIN_SIZE:
+            return DropBehindFileWrapper(f, block_size)
+        return FileWrapper(f, block_size)
+    
+    return wrap
+
+MERGE_COPY_SIZE = 16 * 1024 * 1024  # bytes per copy_file_range/sendfile call
+
+def append_file(src_fd, dst_fd):
+    """Append the rest of src_fd to dst_fd, copying inside the kernel where possible"""
+    # Both calls advance the file offsets, so each fallback resumes where the last stopped
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while os.copy_file_range(src_fd, dst_fd, MERGE_COPY_SIZE):
+                pass
+            return
+        except OSError:
+            pass
+    if hasattr(os, 'sendfile'):
+        try:
+            while os.sendfile(dst_fd, src_fd, None, MERGE_COPY_SIZE):
+                pass
+            return
+        except (OSError, TypeError):
+            pass
+    with open(src_fd, 'rb', closefd=False) as src, open(dst_fd, 'wb', closefd=False) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
 
 def merge_chunks_high_speed(temp_dir, final_path, total_chunks):
-    """High-speed parallel chunk merging"""
-    perf_settings = get_performance_settings()
+    """Merge chunks in order with zero-copy appends; memory use stays constant"""
+    chunk_paths = [os.path.join(temp_dir, f'chunk_{i:06d}') for i in range(total_chunks)]
+    total_size = sum(os.path.getsize(path) for path in chunk_paths)
     
-    with open(final_path, 'wb') as final_file:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=perf_settings['max_workers']) as executor:
-            chunk_data = {}
-            
-            # Submit all read operations
-            future_to_chunk = {
-                executor.submit(read_chunk_file, temp_dir, i): i 
-                for i in range(total_chunks)
-            }
-            
-            # Collect results
-            for future in concurrent.futures.as_completed(future_to_chunk):
-                chunk_index = future_to_chunk[future]
-                chunk_data[chunk_index] = future.result()
-            
-            # Write in order with large buffer
-            for i in range(total_chunks):
-                final_file.write(chunk_data[i])
-                del chunk_data[i]
+    fd = os.open(final_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # Reserve the full size up front: one contiguous extent, no per-write metadata growth
+        if total_size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fd, 0, total_size)
+            except OSError as e:
+                logger.warning(f"posix_fallocate unavailable for {final_path}: {e}")
+        
+        for chunk_path in chunk_paths:
+            with open(chunk_path, 'rb') as chunk_file:
+                append_file(chunk_file.fileno(), fd)
+    finally:
+        os.close(fd)
+
+def record_chunk(file_id, chunk_number, total_chunks):
+    """Mark a chunk as received; returns (distinct chunks received, whether this one completed the upload)"""
+    # Kept in SQLite rather than process memory: chunks of one upload reach different workers
+    with pool.acquire() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT received, completed FROM chunk_uploads WHERE file_id = ?',
+                           (file_id,)).fetchone()
+        if row and row['completed']:
+            # Another request already merged this upload; a retry must not start a new count
+            conn.rollback()
+            return row['received'], False
+        
+        cursor = conn.execute('INSERT OR IGNORE INTO upload_chunks (file_id, chunk_number) VALUES (?, ?)',
+                              (file_id, chunk_number))
+        if cursor.rowcount:
+            conn.execute('''
+                INSERT INTO chunk_uploads (file_id, received, updated_at) VALUES (?, 1, ?)
+                ON CONFLICT(file_id) DO UPDATE
+                SET received = received + 1, updated_at = excluded.updated_at
+            ''', (file_id, int(time.time())))
+        
+        row = conn.execute('SELECT received FROM chunk_uploads WHERE file_id = ?', (file_id,)).fetchone()
+        received = row[0] if row else total_chunks
+        
+        # Only the request that added the last new chunk merges
+        completed = bool(cursor.rowcount) and received == total_chunks
+        if completed:
+            conn.execute('DELETE FROM upload_chunks WHERE file_id = ?', (file_id,))
+            conn.execute('UPDATE chunk_uploads SET completed = 1 WHERE file_id = ?', (file_id,))
+        conn.commit()
+    
+    return received, completed
+
+def chunk_upload_completed(file_id):
+    """Whether a chunked upload has already been merged by some request"""
+    with pool.acquire() as conn:
+        row = conn.execute('SELECT completed FROM chunk_uploads WHERE file_id = ?', (file_id,)).fetchone()
+    return bool(row and row['completed'])
 
 # ===== MIDDLEWARE =====
+# Only page views count as visits; API polls and upload chunks would flood the visitor table
+_TRACKED_ENDPOINTS = {'index', 'share_page'}
+
 @app.before_request
 def track_visitors():
-    if request.endpoint and not request.endpoint.startswith('static'):
+    if request.endpoint in _TRACKED_ENDPOINTS:
         visitor_tracker.track_visitor(request)
 
+_UPLOAD_ENDPOINTS = {'upload_file', 'upload_raw', 'upload_chunked'}
+
 @app.before_request
 def update_max_content_length():
     """Update file size limit before upload requests"""
-    if request.endpoint == 'upload_file' or request.endpoint == 'upload_chunked':
+    # Picks up an admin change made through another worker within SETTINGS_CACHE_TTL
+    if request.endpoint in _UPLOAD_ENDPOINTS:
         app.config['MAX_CONTENT_LENGTH'] = get_max_content_length()
 
 # ===== MAIN ROUTES =====
@@ -571,20 +1146,101 @@ def get_performance_config():
         logger.error(f"Performance config error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
+def store_upload(stream, filename, mime_type, description):
+    """Create the file record and stream the upload body straight to storage"""
+    admin_settings = get_admin_settings()
+    perf_settings = get_performance_settings()
+    
+    expire_days = admin_settings['expire_days']
+    download_limit = admin_settings['download_limit'] 
+    is_public = True
+    
+    # Generate file info
+    file_id = str(uuid.uuid4())
+    share_code = generate_share_code()
+    original_name = secure_filename(filename)
+    file_ext = original_name.rsplit('.', 1)[1].lower() if '.' in original_name else ''
+    stored_name = f"{file_id}.{file_ext}" if file_ext else file_id
+    file_path = os.path.join(STORAGE_FOLDER, stored_name)
+    
+    file_type = get_file_type(original_name)
+    uploaded_at = int(time.time())
+    expires_at = uploaded_at + expire_days * 86400
+    
+    # Create database record first
     try:
-        logger.info("Upload request received")
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(INSERT_FILE_SQL, (
+                file_id, original_name, stored_name, file_type, 0,
+                mime_type or 'application/octet-stream', share_code, None, 
+                download_limit, uploaded_at, expires_at, request.remote_addr, description, is_public
+            ))
+            
+            conn.commit()
+            
+    except Exception as db_error:
+        logger.error(f"Database error: {db_error}")
+        return jsonify({'success': False, 'error': f'Lỗi cơ sở dữ liệu: {str(db_error)}'}), 500
+    
+    # Save file with optimized I/O
+    try:
+        buffer_size = get_io_buffer_size(perf_settings)
         
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'error': 'Không có file được chọn'}), 400
+        with open(file_path, 'wb') as f:
+            total_size = write_stream(stream, f, buffer_size)
         
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'Không có file được chọn'}), 400
+        # Update file size
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE files SET file_size = ? WHERE id = ?', (total_size, file_id))
+            conn.commit()
+        
+    except Exception as save_error:
+        logger.error(f"Error saving file: {save_error}")
+        # Cleanup; the partial file goes too, nothing without a row would ever remove it
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        try:
+            with pool.acquire() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
+                conn.commit()
+        except:
+            pass
+        return jsonify({'success': False, 'error': f'Lỗi lưu file: {str(save_error)}'}), 500
+    
+    # Generate response
+    share_url = request.url_root + f"f/{share_code}"
+    
+    return jsonify({
+        'success': True,
+        'file_id': file_id,
+        'share_code': share_code,
+        'share_url': share_url,
+        'qr_url': url_for('share_qr_code', share_code=share_code),
+        'expires_at': datetime.fromtimestamp(expires_at, timezone.utc).isoformat(),
+        'expire_days': expire_days,
+        'file_size': format_file_size(total_size),
+        'file_type': file_type
+    })
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    try:
+        logger.info("Upload request received")
+        
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'error': 'Không có file được chọn'}), 400
+        
+        file = request.files['file']
+        if file.filename == '':
+            return jsonify({'success': False, 'error': 'Không có file được chọn'}), 400
         
         admin_settings = get_admin_settings()
-        perf_settings = get_performance_settings()
         
         # Check file size
         if hasattr(file, 'content_length') and file.content_length:
@@ -593,93 +1249,34 @@ def upload_file():
                 return jsonify({'success': False, 'error': f'File quá lớn. Tối đa {admin_settings["max_size_gb"]}GB'}), 413
         
         description = request.form.get('description', '')
-        expire_days = admin_settings['expire_days']
-        download_limit = admin_settings['download_limit'] 
-        is_public = True
-        
-        # Generate file info
-        file_id = str(uuid.uuid4())
-        share_code = generate_share_code()
-        original_name = secure_filename(file.filename)
-        file_ext = original_name.rsplit('.', 1)[1].lower() if '.' in original_name else ''
-        stored_name = f"{file_id}.{file_ext}" if file_ext else file_id
-        file_path = os.path.join(STORAGE_FOLDER, stored_name)
-        
-        file_type = get_file_type(original_name)
-        expires_at = datetime.now(timezone.utc) + timedelta(days=expire_days)
-        
-        # Create database record first
-        try:
-            conn = sqlite3.connect('file_storage.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO files (
-                    id, original_name, stored_name, file_type, file_size, 
-                    mime_type, share_code, password, download_limit, expires_at, 
-                    uploader_ip, description, is_public
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                file_id, original_name, stored_name, file_type, 0,
-                file.mimetype or 'application/octet-stream', share_code, None, 
-                download_limit, expires_at, request.remote_addr, description, is_public
-            ))
-            
-            conn.commit()
-            conn.close()
-            
-        except Exception as db_error:
-            logger.error(f"Database error: {db_error}")
-            return jsonify({'success': False, 'error': f'Lỗi cơ sở dữ liệu: {str(db_error)}'}), 500
         
-        # Save file with optimized I/O
-        try:
-            buffer_size = perf_settings['buffer_size_kb'] * 1024
-            total_size = 0
-            
-            with open(file_path, 'wb') as f:
-                while True:
-                    chunk = file.stream.read(buffer_size)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-                    total_size += len(chunk)
-            
-            # Update file size
-            conn = sqlite3.connect('file_storage.db')
-            cursor = conn.cursor()
-            cursor.execute('UPDATE files SET file_size = ? WHERE id = ?', (total_size, file_id))
-            conn.commit()
-            conn.close()
-            
-        except Exception as save_error:
-            logger.error(f"Error saving file: {save_error}")
-            # Cleanup
-            try:
-                conn = sqlite3.connect('file_storage.db')
-                cursor = conn.cursor()
-                cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
-                conn.commit()
-                conn.close()
-            except:
-                pass
-            return jsonify({'success': False, 'error': f'Lỗi lưu file: {str(save_error)}'}), 500
+        return store_upload(file.stream, file.filename, file.mimetype, description)
         
-        # Generate response
-        share_url = request.url_root + f"f/{share_code}"
-        qr_code = generate_qr_code(share_url)
+    except Exception as e:
+        logger.error(f"Upload error: {e}")
+        return jsonify({'success': False, 'error': f'Lỗi tải lên: {str(e)}'}), 500
+
+@app.route('/upload/raw', methods=['POST'])
+def upload_raw():
+    """Upload with the file as the raw request body, skipping multipart parsing and temp spooling"""
+    try:
+        logger.info("Raw upload request received")
         
-        return jsonify({
-            'success': True,
-            'file_id': file_id,
-            'share_code': share_code,
-            'share_url': share_url,
-            'qr_code': qr_code,
-            'expires_at': expires_at.isoformat(),
-            'expire_days': expire_days,
-            'file_size': format_file_size(total_size),
-            'file_type': file_type
-        })
+        filename = unquote(request.headers.get('X-Filename', ''))
+        if not filename:
+            return jsonify({'success': False, 'error': 'Không có file được chọn'}), 400
+        
+        admin_settings = get_admin_settings()
+        
+        # Check file size
+        if request.content_length:
+            max_size = admin_settings['max_size_gb'] * 1024 * 1024 * 1024
+            if request.content_length > max_size:
+                return jsonify({'success': False, 'error': f'File quá lớn. Tối đa {admin_settings["max_size_gb"]}GB'}), 413
+        
+        description = unquote(request.headers.get('X-Description', ''))
+        
+        return store_upload(request.stream, filename, request.mimetype, description)
         
     except Exception as e:
         logger.error(f"Upload error: {e}")
@@ -696,6 +1293,30 @@ def upload_chunked():
         if not file_id:
             file_id = str(uuid.uuid4())
         
+        # A retry of a chunk that arrives after the merge: answer without touching disk
+        if chunk_upload_completed(file_id):
+            with pool.acquire() as conn:
+                file_data = conn.execute('SELECT share_code, file_size FROM files WHERE id = ?',
+                                         (file_id,)).fetchone()
+            if not file_data:
+                # Still merging in the request that completed it
+                return jsonify({
+                    'success': True,
+                    'completed': False,
+                    'uploaded_chunks': total_chunks,
+                    'total_chunks': total_chunks,
+                    'progress': 100
+                })
+            return jsonify({
+                'success': True,
+                'completed': True,
+                'file_id': file_id,
+                'share_code': file_data['share_code'],
+                'share_url': request.url_root + f"f/{file_data['share_code']}",
+                'qr_url': url_for('share_qr_code', share_code=file_data['share_code']),
+                'file_size': format_file_size(file_data['file_size'])
+            })
+        
         chunk_data = request.files['chunk']
         perf_settings = get_performance_settings()
         
@@ -705,7 +1326,7 @@ def upload_chunked():
         
         # Save chunk with optimized I/O
         chunk_path = os.path.join(temp_dir, f'chunk_{chunk_number:06d}')
-        buffer_size = perf_settings['buffer_size_kb'] * 1024
+        buffer_size = get_io_buffer_size(perf_settings)
         
         with open(chunk_path, 'wb') as f:
             while True:
@@ -715,9 +1336,9 @@ def upload_chunked():
                 f.write(data)
         
         # Check completion
-        uploaded_chunks = len([f for f in os.listdir(temp_dir) if f.startswith('chunk_')])
+        uploaded_chunks, completed = record_chunk(file_id, chunk_number, total_chunks)
         
-        if uploaded_chunks == total_chunks:
+        if completed:
             # Merge chunks
             admin_settings = get_admin_settings()
             final_filename = secure_filename(original_filename)
@@ -727,35 +1348,28 @@ def upload_chunked():
             
             merge_chunks_high_speed(temp_dir, final_path, total_chunks)
             
-            # Cleanup temp
-            shutil.rmtree(temp_dir)
+            # Cleanup temp (in the background)
+            temp_cleanup_queue.put(temp_dir)
             
             # Create database record
             file_size = os.path.getsize(final_path)
             share_code = generate_share_code()
             file_type = get_file_type(original_filename)
-            expires_at = datetime.now(timezone.utc) + timedelta(days=admin_settings['expire_days'])
+            uploaded_at = int(time.time())
+            expires_at = uploaded_at + admin_settings['expire_days'] * 86400
             
-            conn = sqlite3.connect('file_storage.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO files (
-                    id, original_name, stored_name, file_type, file_size, 
-                    mime_type, share_code, password, download_limit, expires_at, 
-                    uploader_ip, description, is_public
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                file_id, original_filename, stored_name, file_type, file_size,
-                'application/octet-stream', share_code, None, 
-                admin_settings['download_limit'], expires_at, request.remote_addr, '', True
-            ))
-            
-            conn.commit()
-            conn.close()
+            with pool.acquire() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(INSERT_FILE_SQL, (
+                    file_id, original_filename, stored_name, file_type, file_size,
+                    'application/octet-stream', share_code, None, 
+                    admin_settings['download_limit'], uploaded_at, expires_at, request.remote_addr, '', True
+                ))
+                
+                conn.commit()
             
             share_url = request.url_root + f"f/{share_code}"
-            qr_code = generate_qr_code(share_url)
             
             return jsonify({
                 'success': True,
@@ -763,7 +1377,7 @@ def upload_chunked():
                 'file_id': file_id,
                 'share_code': share_code,
                 'share_url': share_url,
-                'qr_code': qr_code,
+                'qr_url': url_for('share_qr_code', share_code=share_code),
                 'file_size': format_file_size(file_size)
             })
         
@@ -782,46 +1396,36 @@ def upload_chunked():
 @app.route('/f/<share_code>')
 def share_page(share_code):
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM files WHERE share_code = ?', (share_code,))
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            abort(404)
-        
-        file_data = {
-            'id': result[0],
-            'original_name': result[1],
-            'file_type': result[3],
-            'file_size': format_file_size(result[4]),
-            'share_code': result[6],
-            'has_password': False,
-            'download_limit': result[8],
-            'download_count': result[9],
-            'expires_at': result[11],
-            'description': result[14]
-        }
-        
-        # Check if expired
-        if file_data['expires_at']:
-            expires_at = datetime.fromisoformat(file_data['expires_at'].replace('Z', '+00:00'))
-            if datetime.now(timezone.utc) > expires_at:
-                conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, original_name, file_type, file_size, share_code,
+                       download_limit, download_count, expires_at, description
+                FROM files WHERE share_code = ?
+            ''', (share_code,))
+            result = cursor.fetchone()
+            
+            if not result:
+                abort(404)
+            
+            file_data = dict(result)
+            file_data['file_size'] = format_file_size(result['file_size'])
+            file_data['has_password'] = False
+            
+            # Check if expired
+            now = int(time.time())
+            if file_data['expires_at'] and now > file_data['expires_at']:
                 return render_template('index.html', error='File đã hết hạn')
-        
-        # Check download limit
-        if file_data['download_count'] >= file_data['download_limit']:
-            conn.close()
-            return render_template('index.html', error='File đã đạt giới hạn tải xuống')
-        
-        # Update last accessed
-        cursor.execute('UPDATE files SET last_accessed = ? WHERE share_code = ?', 
-                      (datetime.now(timezone.utc), share_code))
-        conn.commit()
-        conn.close()
+            
+            # Check download limit
+            if file_data['download_count'] >= file_data['download_limit']:
+                return render_template('index.html', error='File đã đạt giới hạn tải xuống')
+            
+            # Update last accessed
+            cursor.execute('UPDATE files SET last_accessed = ? WHERE share_code = ?', 
+                          (now, share_code))
+            conn.commit()
         
         return render_template('index.html', shared_file=file_data, show_download=True)
         
@@ -829,92 +1433,114 @@ def share_page(share_code):
         logger.error(f"Share page error: {e}")
         abort(500)
 
+@app.route('/qr/<share_code>.png')
+def share_qr_code(share_code):
+    """QR image for a share link, rendered on demand instead of in the upload response"""
+    with pool.acquire() as conn:
+        exists = conn.execute('SELECT 1 FROM files WHERE share_code = ?', (share_code,)).fetchone()
+    
+    if not exists:
+        abort(404)
+    
+    png = generate_qr_code(request.url_root + f"f/{share_code}")
+    if png is None:
+        abort(500)
+    
+    return Response(png, mimetype='image/png', headers={'Cache-Control': 'public, max-age=86400'})
+
 @app.route('/download/<share_code>')
 def download_file(share_code):
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM files WHERE share_code = ?', (share_code,))
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            abort(404)
-        
-        file_data = {
-            'id': result[0],
-            'original_name': result[1],
-            'stored_name': result[2],
-            'download_limit': result[8],
-            'download_count': result[9],
-            'expires_at': result[11]
-        }
-        
-        # Check if expired
-        if file_data['expires_at']:
-            expires_at = datetime.fromisoformat(file_data['expires_at'].replace('Z', '+00:00'))
-            if datetime.now(timezone.utc) > expires_at:
-                conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT id, original_name, stored_name, download_limit, download_count, expires_at
+                FROM files WHERE share_code = ?
+            ''', (share_code,))
+            file_data = cursor.fetchone()
+            
+            if not file_data:
+                abort(404)
+            
+            # Check if expired
+            if file_data['expires_at'] and time.time() > file_data['expires_at']:
                 return jsonify({'error': 'File đã hết hạn'}), 410
+            
+            # Check download limit
+            if file_data['download_count'] >= file_data['download_limit']:
+                return jsonify({'error': 'File đã đạt giới hạn tải xuống'}), 403
         
-        # Check download limit
-        if file_data['download_count'] >= file_data['download_limit']:
-            conn.close()
-            return jsonify({'error': 'File đã đạt giới hạn tải xuống'}), 403
-        
-        # Check if file exists
         file_path = os.path.join(STORAGE_FOLDER, file_data['stored_name'])
-        if not os.path.exists(file_path):
-            conn.close()
-            return jsonify({'error': 'File không tồn tại'}), 404
-        
-        file_size = os.path.getsize(file_path)
         perf_settings = get_performance_settings()
         
-        # Update download count and log
-        cursor.execute('UPDATE files SET download_count = download_count + 1, last_accessed = ? WHERE share_code = ?', 
-                      (datetime.now(timezone.utc), share_code))
-        
-        cursor.execute('''
-            INSERT INTO download_stats (file_id, file_name, download_ip, user_agent)
-            VALUES (?, ?, ?, ?)
-        ''', (file_data['id'], file_data['original_name'], 
-              request.remote_addr, request.headers.get('User-Agent', '')))
-        
-        conn.commit()
-        conn.close()
-        
-        # High-speed streaming download
-        def generate_file_stream():
-            with open(file_path, 'rb') as f:
-                if file_size > 100 * 1024 * 1024:  # Files > 100MB use memory mapping
-                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mmapped_file:
-                        chunk_size = perf_settings['buffer_size_kb'] * 1024
-                        offset = 0
-                        while offset < len(mmapped_file):
-                            chunk = mmapped_file[offset:offset + chunk_size]
-                            yield chunk
-                            offset += chunk_size
-                else:
-                    # Smaller files use regular read
-                    chunk_size = perf_settings['buffer_size_kb'] * 1024
-                    while True:
-                        chunk = f.read(chunk_size)
-                        if not chunk:
-                            break
-                        yield chunk
-        
-        response = Response(
-            generate_file_stream(),
-            mimetype='application/octet-stream',
-            headers={
-                'Content-Disposition': f'attachment; filename="{file_data["original_name"]}"',
-                'Content-Length': str(file_size),
-                'Accept-Ranges': 'bytes',
-                'Cache-Control': 'no-cache'
-            }
-        )
+        if USE_X_SENDFILE:
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                return jsonify({'error': 'File không tồn tại'}), 404
+            
+            response = Response(
+                mimetype='application/octet-stream',
+                headers=offload_headers(file_data['stored_name'], file_data['original_name'])
+            )
+            # The proxy answers Range and conditional requests itself, so decide from
+            # the request; only validators that still match the file become a 304
+            first_fetch = (
+                request.range is None or request.range.ranges[0][0] == 0
+            ) and not proxy_revalidates(stat)
+        else:
+            # One path lookup: the open file answers existence, size and mtime, and its
+            # descriptor is what the server's sendfile() streams from
+            try:
+                f = open(file_path, 'rb')
+            except FileNotFoundError:
+                return jsonify({'error': 'File không tồn tại'}), 404
+            stat = os.fstat(f.fileno())
+            
+            # gunicorn/uWSGI provide wsgi.file_wrapper and stream the open file with
+            # sendfile(); elsewhere Werkzeug's fallback would read only 8 KB at a time
+            request.environ.setdefault('wsgi.file_wrapper',
+                                       sequential_file_wrapper(get_download_block_size(perf_settings)))
+            
+            # Stored files are never rewritten, so their unique name is a stable ETag
+            response = send_file(
+                f,
+                mimetype='application/octet-stream',
+                as_attachment=True,
+                download_name=file_data['original_name'],
+                last_modified=stat.st_mtime,
+                etag=file_data['stored_name']
+            )
+            # send_file only knows the size of paths, so apply Range/304 handling here
+            response.content_length = stat.st_size
+            try:
+                response = response.make_conditional(request, accept_ranges=True,
+                                                     complete_length=stat.st_size)
+            except RequestedRangeNotSatisfiable:
+                f.close()
+                return Response(status=416, headers={'Content-Range': f'bytes */{stat.st_size}'})
+            
+            # Only prefetch when a body will actually be read
+            if request.method != 'HEAD':
+                if response.status_code == 200:
+                    advise_download(f.fileno(), 0, stat.st_size)
+                elif response.status_code == 206:
+                    advise_download(f.fileno(), response.content_range.start, stat.st_size)
+            first_fetch = response.status_code == 200 or (
+                response.status_code == 206 and response.content_range.start == 0)
+        
+        # Resumed and parallel range requests are part of one download; count only
+        # the full fetch or the range that starts at byte 0 (never a 304 revalidation,
+        # nor the HEAD probe download managers send first)
+        if first_fetch and request.method != 'HEAD':
+            with pool.acquire() as conn:
+                conn.execute('UPDATE files SET download_count = download_count + 1, last_accessed = ? WHERE share_code = ?', 
+                             (int(time.time()), share_code))
+                conn.commit()
+            
+            download_stats_writer.record(file_data['id'], file_data['original_name'],
+                                         request.remote_addr, request.headers.get('User-Agent', ''))
         
         return response
         
@@ -926,24 +1552,20 @@ def download_file(share_code):
 @app.route('/banner/click/<int:banner_id>')
 def banner_click(banner_id):
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE banners SET clicks = clicks + 1 WHERE id = ?', (banner_id,))
-        cursor.execute('SELECT link_url FROM banners WHERE id = ?', (banner_id,))
-        result = cursor.fetchone()
+        # The redirect never waits on SQLite: the link is cached, the click flushed later
+        link_url = get_banner_link(banner_id)
+        if link_url is not None:
+            banner_click_counter.add(banner_id)
         
-        conn.commit()
-        conn.close()
-        
-        if result and result[0]:
-            return redirect(result[0])
-        else:
-            return redirect(url_for('index'))
+        response = redirect(link_url or url_for('index'))
             
     except Exception as e:
         logger.error(f"Banner click error: {e}")
-        return redirect(url_for('index'))
+        response = redirect(url_for('index'))
+    
+    # Every click has to reach the server to be counted
+    response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return response
 
 # ===== ADMIN ROUTES =====
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -952,15 +1574,13 @@ def admin_login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', ('admin_username',))
-        db_username = cursor.fetchone()[0]
-        cursor.execute('SELECT value FROM settings WHERE key = ?', ('admin_password_hash',))
-        db_password_hash = cursor.fetchone()[0]
-        conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT key, value FROM settings WHERE key IN (?, ?)', 
+                          ('admin_username', 'admin_password_hash'))
+            credentials = dict(cursor.fetchall())
         
-        if username == db_username and check_password_hash(db_password_hash, password):
+        if username == credentials['admin_username'] and check_password_hash(credentials['admin_password_hash'], password):
             session['admin_logged_in'] = True
             session['admin_username'] = username
             return redirect(url_for('admin_dashboard'))
@@ -985,27 +1605,25 @@ def admin_dashboard():
 @admin_required
 def admin_stats():
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        # Active visitors
-        cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=5)
-        cursor.execute('SELECT COUNT(*) FROM visitors WHERE is_active = 1 AND last_activity > ?', (cutoff_time,))
-        active_visitors = cursor.fetchone()[0]
-        
-        # Total files
-        cursor.execute('SELECT COUNT(*) FROM files WHERE expires_at > ?', (datetime.now(timezone.utc),))
-        total_files = cursor.fetchone()[0]
-        
-        # Total downloads
-        cursor.execute('SELECT SUM(download_count) FROM files')
-        total_downloads = cursor.fetchone()[0] or 0
-        
-        # Active banners
-        cursor.execute('SELECT COUNT(*) FROM banners WHERE status = 1')
-        active_banners = cursor.fetchone()[0]
-        
-        conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            # Active visitors
+            cutoff_time = int(time.time()) - 300
+            cursor.execute('SELECT COUNT(*) FROM visitors WHERE is_active = 1 AND last_activity > ?', (cutoff_time,))
+            active_visitors = cursor.fetchone()[0]
+            
+            # Total files
+            cursor.execute('SELECT COUNT(*) FROM files WHERE expires_at > ?', (int(time.time()),))
+            total_files = cursor.fetchone()[0]
+            
+            # Total downloads
+            cursor.execute('SELECT SUM(download_count) FROM files')
+            total_downloads = cursor.fetchone()[0] or 0
+            
+            # Active banners
+            cursor.execute('SELECT COUNT(*) FROM banners WHERE status = 1')
+            active_banners = cursor.fetchone()[0]
         
         return jsonify({
             'success': True,
@@ -1024,68 +1642,60 @@ def admin_stats():
 @admin_required
 def admin_performance():
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        if request.method == 'GET':
-            cursor.execute('''
-                SELECT key, value, description FROM settings 
-                WHERE key IN (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                'chunk_size_mb', 'max_concurrent_chunks', 'max_workers',
-                'enable_chunked_upload', 'enable_compression', 'enable_caching', 
-                'buffer_size_kb', 'connection_timeout'
-            ))
-            
-            settings = []
-            for row in cursor.fetchall():
-                settings.append({
-                    'key': row[0],
-                    'value': row[1],
-                    'description': row[2]
-                })
-            
-            conn.close()
-            return jsonify({'success': True, 'settings': settings})
-            
-        elif request.method == 'POST':
-            data = request.get_json()
-            settings_to_update = data.get('settings', {})
-            
-            # Validate performance settings
-            validation_errors = []
-            
-            for key, value in settings_to_update.items():
-                if key == 'chunk_size_mb':
-                    if not (1 <= int(value) <= 100):
-                        validation_errors.append('Chunk size phải từ 1-100 MB')
-                elif key == 'max_concurrent_chunks':
-                    if not (1 <= int(value) <= 20):
-                        validation_errors.append('Max concurrent chunks phải từ 1-20')
-                elif key == 'max_workers':
-                    if not (1 <= int(value) <= 20):
-                        validation_errors.append('Max workers phải từ 1-20')
-                elif key == 'buffer_size_kb':
-                    if not (64 <= int(value) <= 8192):
-                        validation_errors.append('Buffer size phải từ 64-8192 KB')
-                elif key == 'connection_timeout':
-                    if not (30 <= int(value) <= 3600):
-                        validation_errors.append('Connection timeout phải từ 30-3600 giây')
-            
-            if validation_errors:
-                conn.close()
-                return jsonify({'success': False, 'error': '; '.join(validation_errors)})
-            
-            # Update settings
-            for key, value in settings_to_update.items():
-                cursor.execute('UPDATE settings SET value = ? WHERE key = ?', (value, key))
-            
-            conn.commit()
-            conn.close()
-            
-            logger.info("Performance settings updated")
-            return jsonify({'success': True, 'message': 'Cài đặt hiệu suất đã được cập nhật'})
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
             
+            if request.method == 'GET':
+                cursor.execute('''
+                    SELECT key, value, description FROM settings 
+                    WHERE key IN (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    'chunk_size_mb', 'max_concurrent_chunks', 'max_workers',
+                    'enable_chunked_upload', 'enable_compression', 'enable_caching', 
+                    'buffer_size_kb', 'connection_timeout'
+                ))
+                
+                settings = [dict(row) for row in cursor]
+                
+                return jsonify({'success': True, 'settings': settings})
+                
+            elif request.method == 'POST':
+                data = request.get_json()
+                settings_to_update = data.get('settings', {})
+                
+                # Validate performance settings
+                validation_errors = []
+                
+                for key, value in settings_to_update.items():
+                    if key == 'chunk_size_mb':
+                        if not (1 <= int(value) <= 100):
+                            validation_errors.append('Chunk size phải từ 1-100 MB')
+                    elif key == 'max_concurrent_chunks':
+                        if not (1 <= int(value) <= 20):
+                            validation_errors.append('Max concurrent chunks phải từ 1-20')
+                    elif key == 'max_workers':
+                        if not (1 <= int(value) <= 20):
+                            validation_errors.append('Max workers phải từ 1-20')
+                    elif key == 'buffer_size_kb':
+                        if not (64 <= int(value) <= 8192):
+                            validation_errors.append('Buffer size phải từ 64-8192 KB')
+                    elif key == 'connection_timeout':
+                        if not (30 <= int(value) <= 3600):
+                            validation_errors.append('Connection timeout phải từ 30-3600 giây')
+                
+                if validation_errors:
+                    return jsonify({'success': False, 'error': '; '.join(validation_errors)})
+                
+                # Update settings
+                for key, value in settings_to_update.items():
+                    cursor.execute('UPDATE settings SET value = ? WHERE key = ?', (value, key))
+                
+                conn.commit()
+                invalidate_settings_cache()
+                
+                logger.info("Performance settings updated")
+                return jsonify({'success': True, 'message': 'Cài đặt hiệu suất đã được cập nhật'})
+                
     except Exception as e:
         logger.error(f"Performance API error: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -1095,14 +1705,11 @@ def admin_performance():
 def admin_cache():
     try:
         if request.method == 'GET':
-            total_files = 0
-            total_size = 0
-            
-            for filename in os.listdir(STORAGE_FOLDER):
-                file_path = os.path.join(STORAGE_FOLDER, filename)
-                if os.path.isfile(file_path):
-                    total_files += 1
-                    total_size += os.path.getsize(file_path)
+            # Sizes are recorded at upload time, so no directory walk is needed here
+            with pool.acquire() as conn:
+                total_files, total_size = conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(file_size), 0) FROM files'
+                ).fetchone()
             
             cache_info = {
                 'total_files': total_files,
@@ -1115,37 +1722,41 @@ def admin_cache():
             data = request.get_json()
             action = data.get('action')
             
-            if action == 'cleanup_old':
+            if action == 'verify_fs':
+                # Actual usage on disk, including files the database no longer knows about
+                total_files = 0
+                total_size = 0
+                
+                with os.scandir(STORAGE_FOLDER) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            total_files += 1
+                            total_size += entry.stat().st_size
+                
+                cache_info = {
+                    'total_files': total_files,
+                    'total_size_mb': round(total_size / (1024 * 1024), 2)
+                }
+                
+                return jsonify({'success': True, 'cache_info': cache_info})
+                
+            elif action == 'cleanup_old':
                 deleted_count = cache_scheduler.cleanup_expired_files()
                 message = f'Đã xóa {deleted_count} file hết hạn'
                 
             elif action == 'clear_all':
-                deleted_count = 0
                 try:
-                    conn = sqlite3.connect('file_storage.db')
-                    cursor = conn.cursor()
-                    
-                    cursor.execute('SELECT stored_name FROM files')
-                    all_files = cursor.fetchall()
-                    
-                    for (stored_name,) in all_files:
-                        file_path = os.path.join(STORAGE_FOLDER, stored_name)
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            deleted_count += 1
-                    
-                    cursor.execute('DELETE FROM files')
-                    cursor.execute('DELETE FROM download_stats')
-                    
-                    conn.commit()
-                    conn.close()
-                    
-                    message = f'Đã xóa tất cả {deleted_count} file'
-                    
+                    job_id, total = start_clear_all()
                 except Exception as e:
                     logger.error(f"Clear all cache error: {e}")
                     return jsonify({'success': False, 'error': str(e)})
                 
+                return jsonify({
+                    'success': True,
+                    'message': f'Đang xóa {total} file trong nền',
+                    'job_id': job_id
+                }), 202
+                
             else:
                 return jsonify({'success': False, 'error': 'Invalid action'})
             
@@ -1159,118 +1770,121 @@ def admin_cache():
         logger.error(f"Cache API error: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/admin/api/cache/job/<job_id>')
+@admin_required
+def admin_cache_job(job_id):
+    with pool.acquire() as conn:
+        job = conn.execute('SELECT status, total, processed, deleted FROM cache_jobs WHERE id = ?',
+                           (job_id,)).fetchone()
+    
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, 'job': dict(job)})
+
 @app.route('/admin/api/banners', methods=['GET', 'POST', 'PUT', 'DELETE'])
 @admin_required
 def admin_banners():
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        if request.method == 'GET':
-            cursor.execute('SELECT * FROM banners ORDER BY id DESC')
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
             
-            banners = []
-            for row in cursor.fetchall():
-                banners.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'description': row[2],
-                    'image_path': row[3],
-                    'link_url': row[4],
-                    'position': row[5],
-                    'clicks': row[6],
-                    'status': bool(row[7]),
-                    'created_at': row[8]
+            if request.method == 'GET':
+                cursor.execute('''
+                    SELECT id, title, description, image_path, link_url, position, 
+                           clicks, status, created_at
+                    FROM banners ORDER BY id DESC
+                ''')
+                
+                banners = [dict(row, status=bool(row['status'])) for row in cursor]
+                
+                return jsonify({'success': True, 'banners': banners})
+                
+            elif request.method == 'POST':
+                data = request.get_json()
+                if not data:
+                    return jsonify({'success': False, 'error': 'No data received'})
+                
+                cursor.execute('''
+                    INSERT INTO banners (title, description, image_path, link_url, position, status)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    data.get('title', ''),
+                    data.get('description', ''),
+                    data.get('image_path', ''),
+                    data.get('link_url', ''),
+                    data.get('position', 'left'),
+                    1 if data.get('status', True) else 0
+                ))
+                
+                banner_id = cursor.lastrowid
+                conn.commit()
+                invalidate_banner_links()
+                
+                return jsonify({
+                    'success': True, 
+                    'banner_id': banner_id, 
+                    'message': 'Banner đã được tạo thành công'
                 })
-            
-            conn.close()
-            return jsonify({'success': True, 'banners': banners})
-            
-        elif request.method == 'POST':
-            data = request.get_json()
-            if not data:
-                return jsonify({'success': False, 'error': 'No data received'})
-            
-            cursor.execute('''
-                INSERT INTO banners (title, description, image_path, link_url, position, status)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                data.get('title', ''),
-                data.get('description', ''),
-                data.get('image_path', ''),
-                data.get('link_url', ''),
-                data.get('position', 'left'),
-                1 if data.get('status', True) else 0
-            ))
-            
-            banner_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'success': True, 
-                'banner_id': banner_id, 
-                'message': 'Banner đã được tạo thành công'
-            })
-            
-        elif request.method == 'PUT':
-            data = request.get_json()
-            if not data or not data.get('id'):
-                return jsonify({'success': False, 'error': 'Missing banner ID'})
-            
-            banner_id = data.get('id')
-            
-            cursor.execute('''
-                UPDATE banners 
-                SET title = ?, description = ?, image_path = ?, link_url = ?, 
-                    position = ?, status = ?
-                WHERE id = ?
-            ''', (
-                data.get('title', ''),
-                data.get('description', ''),
-                data.get('image_path', ''),
-                data.get('link_url', ''),
-                data.get('position', 'left'),
-                1 if data.get('status', True) else 0,
-                banner_id
-            ))
-            
-            conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'success': True, 
-                'message': 'Banner đã được cập nhật thành công'
-            })
-            
-        elif request.method == 'DELETE':
-            data = request.get_json()
-            if not data or not data.get('id'):
-                return jsonify({'success': False, 'error': 'Missing banner ID'})
-            
-            banner_id = data.get('id')
-            
-            cursor.execute('SELECT image_path FROM banners WHERE id = ?', (banner_id,))
-            result = cursor.fetchone()
-            
-            if result and result[0]:
-                image_path = result[0]
-                full_path = os.path.join(app.root_path, image_path.lstrip('/'))
-                if os.path.exists(full_path):
-                    try:
-                        os.remove(full_path)
-                    except:
-                        pass
-            
-            cursor.execute('DELETE FROM banners WHERE id = ?', (banner_id,))
-            conn.commit()
-            conn.close()
-            
-            return jsonify({
-                'success': True, 
-                'message': 'Banner đã được xóa thành công'
-            })
-            
+                
+            elif request.method == 'PUT':
+                data = request.get_json()
+                if not data or not data.get('id'):
+                    return jsonify({'success': False, 'error': 'Missing banner ID'})
+                
+                banner_id = data.get('id')
+                
+                cursor.execute('''
+                    UPDATE banners 
+                    SET title = ?, description = ?, image_path = ?, link_url = ?, 
+                        position = ?, status = ?
+                    WHERE id = ?
+                ''', (
+                    data.get('title', ''),
+                    data.get('description', ''),
+                    data.get('image_path', ''),
+                    data.get('link_url', ''),
+                    data.get('position', 'left'),
+                    1 if data.get('status', True) else 0,
+                    banner_id
+                ))
+                
+                conn.commit()
+                invalidate_banner_links()
+                
+                return jsonify({
+                    'success': True, 
+                    'message': 'Banner đã được cập nhật thành công'
+                })
+                
+            elif request.method == 'DELETE':
+                data = request.get_json()
+                if not data or not data.get('id'):
+                    return jsonify({'success': False, 'error': 'Missing banner ID'})
+                
+                banner_id = data.get('id')
+                
+                cursor.execute('SELECT image_path FROM banners WHERE id = ?', (banner_id,))
+                result = cursor.fetchone()
+                
+                if result and result[0]:
+                    image_path = result[0]
+                    full_path = os.path.join(app.root_path, image_path.lstrip('/'))
+                    if os.path.exists(full_path):
+                        try:
+                            os.remove(full_path)
+                        except:
+                            pass
+                
+                cursor.execute('DELETE FROM banners WHERE id = ?', (banner_id,))
+                conn.commit()
+                invalidate_banner_links()
+                
+                return jsonify({
+                    'success': True, 
+                    'message': 'Banner đã được xóa thành công'
+                })
+                
     except Exception as e:
         logger.error(f"Banner API error: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -1313,35 +1927,35 @@ def admin_upload():
 @admin_required
 def admin_visitors():
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT session_id, ip_address, user_agent, first_visit, last_activity, 
-                   page_views, is_active
-            FROM visitors 
-            ORDER BY last_activity DESC 
-            LIMIT 50
-        ''')
-        
-        visitors = []
-        for row in cursor.fetchall():
-            visitors.append({
-                'session_id': row[0][:8] + '...',
-                'ip_address': row[1],
-                'user_agent': row[2][:50] + '...' if len(row[2]) > 50 else row[2],
-                'first_visit': row[3],
-                'last_activity': row[4],
-                'page_views': row[5],
-                'is_active': bool(row[6])
-            })
-        
-        conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            page, limit = get_pagination()
+            
+            cursor.execute('''
+                SELECT SUBSTR(session_id, 1, 8) || '...' AS session_id, ip_address, 
+                       CASE WHEN LENGTH(user_agent) > 50 THEN SUBSTR(user_agent, 1, 50) || '...'
+                            ELSE user_agent END AS user_agent,
+                       strftime('%Y-%m-%dT%H:%M:%SZ', first_visit, 'unixepoch') AS first_visit,
+                       strftime('%Y-%m-%dT%H:%M:%SZ', last_activity, 'unixepoch') AS last_activity,
+                       page_views, is_active
+                FROM visitors 
+                ORDER BY visitors.last_activity DESC 
+                LIMIT ? OFFSET ?
+            ''', (limit, (page - 1) * limit))
+            
+            visitors = [dict(row, is_active=bool(row['is_active'])) for row in cursor]
+            
+            cursor.execute('SELECT COUNT(*) FROM visitors')
+            total = cursor.fetchone()[0]
         
         return jsonify({
             'success': True,
             'visitors': visitors,
-            'active_count': visitor_tracker.get_active_count()
+            'active_count': visitor_tracker.get_active_count(),
+            'page': page,
+            'limit': limit,
+            'total': total
         })
         
     except Exception as e:
@@ -1352,33 +1966,37 @@ def admin_visitors():
 @admin_required
 def admin_files():
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, original_name, file_type, file_size, 
-                   download_count, uploaded_at, expires_at, uploader_ip
-            FROM files 
-            ORDER BY uploaded_at DESC 
-            LIMIT 50
-        ''')
-        
-        files = []
-        for row in cursor.fetchall():
-            files.append({
-                'id': row[0][:8] + '...',
-                'name': row[1],
-                'type': row[2],
-                'size': format_file_size(row[3]),
-                'downloads': row[4],
-                'uploaded_at': row[5],
-                'expires_at': row[6],
-                'uploader_ip': row[7]
-            })
-        
-        conn.close()
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
+            
+            page, limit = get_pagination()
+            
+            cursor.execute('''
+                SELECT SUBSTR(id, 1, 8) || '...' AS id, original_name AS name, file_type AS type, 
+                       file_size, download_count AS downloads, 
+                       strftime('%Y-%m-%dT%H:%M:%SZ', uploaded_at, 'unixepoch') AS uploaded_at,
+                       strftime('%Y-%m-%dT%H:%M:%SZ', expires_at, 'unixepoch') AS expires_at, uploader_ip
+                FROM files 
+                ORDER BY files.uploaded_at DESC 
+                LIMIT ? OFFSET ?
+            ''', (limit, (page - 1) * limit))
+            
+            files = []
+            for row in cursor:
+                file_info = dict(row)
+                file_info['size'] = format_file_size(file_info.pop('file_size'))
+                files.append(file_info)
+            
+            cursor.execute('SELECT COUNT(*) FROM files')
+            total = cursor.fetchone()[0]
         
-        return jsonify({'success': True, 'files': files})
+        return jsonify({
+            'success': True,
+            'files': files,
+            'page': page,
+            'limit': limit,
+            'total': total
+        })
         
     except Exception as e:
         logger.error(f"Files API error: {e}")
@@ -1388,48 +2006,39 @@ def admin_files():
 @admin_required
 def admin_settings():
     try:
-        conn = sqlite3.connect('file_storage.db')
-        cursor = conn.cursor()
-        
-        if request.method == 'GET':
-            cursor.execute('SELECT key, value, description FROM settings')
-            settings = []
-            for row in cursor.fetchall():
-                if row[0] == 'admin_password_hash':
-                    continue
-                settings.append({
-                    'key': row[0],
-                    'value': row[1],
-                    'description': row[2]
-                })
-            
-            conn.close()
-            return jsonify({'success': True, 'settings': settings})
-            
-        elif request.method == 'POST':
-            data = request.get_json()
-            settings_to_update = data.get('settings', {})
-            
-            for key, value in settings_to_update.items():
-                if key == 'admin_password':
-                    if len(value) < 6:
-                        conn.close()
-                        return jsonify({'success': False, 'error': 'Mật khẩu phải có ít nhất 6 ký tự'})
-                    
-                    password_hash = generate_password_hash(value)
-                    cursor.execute('UPDATE settings SET value = ? WHERE key = ?', 
-                                 (password_hash, 'admin_password_hash'))
-                else:
-                    cursor.execute('UPDATE settings SET value = ? WHERE key = ?', (value, key))
-            
-            conn.commit()
-            conn.close()
-            
-            # Update MAX_CONTENT_LENGTH if file size changed
-            app.config['MAX_CONTENT_LENGTH'] = get_max_content_length()
-            
-            return jsonify({'success': True, 'message': 'Cài đặt đã được cập nhật'})
+        with pool.acquire() as conn:
+            cursor = conn.cursor()
             
+            if request.method == 'GET':
+                cursor.execute('SELECT key, value, description FROM settings WHERE key != ?', 
+                              ('admin_password_hash',))
+                settings = [dict(row) for row in cursor]
+                
+                return jsonify({'success': True, 'settings': settings})
+                
+            elif request.method == 'POST':
+                data = request.get_json()
+                settings_to_update = data.get('settings', {})
+                
+                for key, value in settings_to_update.items():
+                    if key == 'admin_password':
+                        if len(value) < 6:
+                            return jsonify({'success': False, 'error': 'Mật khẩu phải có ít nhất 6 ký tự'})
+                        
+                        password_hash = generate_password_hash(value)
+                        cursor.execute('UPDATE settings SET value = ? WHERE key = ?', 
+                                     (password_hash, 'admin_password_hash'))
+                    else:
+                        cursor.execute('UPDATE settings SET value = ? WHERE key = ?', (value, key))
+                
+                conn.commit()
+                invalidate_settings_cache()
+                
+                # Update MAX_CONTENT_LENGTH if file size changed
+                app.config['MAX_CONTENT_LENGTH'] = get_max_content_length()
+                
+                return jsonify({'success': True, 'message': 'Cài đặt đã được cập nhật'})
+                
     except Exception as e:
         logger.error(f"Settings API error: {e}")
         return jsonify({'success': False, 'error': str(e)})
@@ -1476,6 +2085,6 @@ if __name__ == '__main__':
     print("  - Configurable chunk sizes")
     print("  - Concurrent upload controls")
     print("  - Buffer size optimization")
-    print("  - Memory-mapped downloads")
+    print("  - Zero-copy sendfile downloads (or nginx/apache offload)")
     print("=" * 70)
     app.run(host='0.0.0.0', port=5000, debug=True)